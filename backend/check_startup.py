@@ -0,0 +1,57 @@
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+
+# Dependencies that must not be imported while the app boots; they are loaded
+# lazily on the code paths that need them.
+HEAVY_MODULES = ["torch", "moviepy", "google.ai.generativelanguage", "edge_tts", "yake", "librosa", "GPUtil"]
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def measure_import(module_name):
+    """Imports a module in a fresh interpreter and returns (seconds, MB added), or None if it fails."""
+    code = (
+        "import time, psutil, importlib\n"
+        "p = psutil.Process()\n"
+        "before = p.memory_info().rss\n"
+        "start = time.perf_counter()\n"
+        f"importlib.import_module({module_name!r})\n"
+        "print(time.perf_counter() - start, (p.memory_info().rss - before) / (1024 * 1024))\n"
+    )
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return None
+    seconds, mb = result.stdout.strip().splitlines()[-1].split()
+    return float(seconds), float(mb)
+
+def report():
+    print("--- App Boot ---")
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    importlib.import_module("app")
+    elapsed = time.perf_counter() - start
+    print(f"import app: {elapsed:.2f}s, +{rss_mb() - base_rss:.1f} MB (process RSS {rss_mb():.1f} MB)")
+
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    if loaded:
+        print(f"WARNING: heavy modules imported at boot: {', '.join(loaded)}")
+    else:
+        print("SUCCESS: no heavy modules imported at boot.")
+
+    print("\n--- Deferred Imports (cost paid on first use) ---")
+    for module_name in HEAVY_MODULES:
+        cost = measure_import(module_name)
+        if cost is None:
+            print(f"{module_name:<20} not installed")
+        else:
+            print(f"{module_name:<20} {cost[0]:6.2f}s  +{cost[1]:7.1f} MB")
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report()
@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from result_cache import link_or_copy
+
+LIBRARY_DIR = os.getenv("STREAMLINE_LIBRARY_DIR", os.path.join(tempfile.gettempdir(), "streamline_library"))
+MAX_LIBRARY_BYTES = 4 * 1024 ** 3   # Least recently used clips are evicted past this total size
+MIN_RESOLUTION_FIT = 0.75   # Skip clips covering less of the target frame than this (e.g. draft renditions in a final render)
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "into", "is", "it", "of",
+    "on", "or", "the", "to", "with", "video", "footage", "stock",
+}
+
+
+def tokenize(*texts):
+    """Splits tags, queries and keywords into the lowercase terms the index is keyed by."""
+    terms = set()
+    for text in texts:
+        for word in re.findall(r"[a-z0-9]+", (text or "").lower()):
+            if len(word) > 1 and word not in STOPWORDS and not word.isdigit():
+                terms.add(word)
+    return terms
+
+
+def resolution_fit(width, height, target_width, target_height):
+    """Fraction of the target frame a clip covers without upscaling, capped at 1."""
+    if not width or not height:
+        return 0
+    return min(1.0, width / target_width, height / target_height)
+
+
+class FootageLibrary:
+    """
+    Downloaded stock clips kept on disk with their provider tags, search query, keywords
+    and probed metadata, plus an inverted index (term -> clip ids) for local lookups.
+    The least recently used clips are evicted once the library grows past max_bytes.
+    Several workers may share one directory: every save merges the index on disk first,
+    and entries whose files another worker evicted are dropped.
+    """
+
+    def __init__(self, directory=LIBRARY_DIR, max_bytes=MAX_LIBRARY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.clips = {}
+        self.terms = {}
+        self._index_mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._reload()
+
+    def _reload(self):
+        """Merges the index on disk (possibly written by another worker) into this one."""
+        self._index_mtime = self._stat_index()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                clips = json.load(f).get("clips", {})
+        except FileNotFoundError:
+            clips = {}
+        except Exception as e:
+            print(f"Footage library index unreadable, keeping what this worker knows: {e}")
+            clips = {}
+
+        for clip_id, entry in clips.items():
+            mine = self.clips.get(clip_id)
+            # Keep the higher-resolution copy, then the more recently used one
+            if mine is None or (entry["width"] * entry["height"], entry.get("last_used", 0)) > (mine["width"] * mine["height"], mine.get("last_used", 0)):
+                self._remove(clip_id)
+                self._add(clip_id, entry)
+        # Drop clips whose files were evicted or replaced by any worker
+        for clip_id in [c for c, entry in self.clips.items() if not os.path.exists(entry["path"])]:
+            self._remove(clip_id)
+
+    def _stat_index(self):
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _write(self):
+        # Per-process and per-thread name so workers sharing the directory don't collide
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"clips": self.clips}, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = self._stat_index()
+
+    def _save(self):
+        self._reload()
+        self._write()
+
+    def _add(self, clip_id, entry):
+        self.clips[clip_id] = entry
+        for term in entry["terms"]:
+            self.terms.setdefault(term, set()).add(clip_id)
+
+    def _remove(self, clip_id):
+        entry = self.clips.pop(clip_id, None)
+        if entry:
+            for term in entry["terms"]:
+                self.terms.get(term, set()).discard(clip_id)
+
+    def ingest(self, video_path, clip_id, tags=(), query="", keywords=()):
+        """
+        Adds a downloaded clip to the library. A clip already stored at an equal or higher
+        resolution is kept as is. Returns the library entry, or None if the file isn't a usable video.
+        """
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+        try:
+            infos = ffmpeg_parse_infos(video_path)
+        except Exception as e:
+            print(f"Footage library could not probe {video_path}: {e}")
+            return None
+        if not infos.get("video_found") or not infos.get("duration"):
+            return None
+        width, height = infos["video_size"]
+
+        with self._lock:
+            existing = self.clips.get(clip_id)
+            if existing and existing["width"] * existing["height"] >= width * height:
+                return existing
+
+            safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", clip_id)
+            stored_path = os.path.join(self.directory, f"{safe_name}_{width}x{height}.mp4")
+            try:
+                if not os.path.exists(stored_path):
+                    link_or_copy(video_path, stored_path)
+                size = os.path.getsize(stored_path)
+            except OSError as e:
+                print(f"Footage library could not store {clip_id}: {e}")
+                return None
+
+            entry = {
+                "path": stored_path,
+                "tags": list(tags),
+                "query": query,
+                "keywords": list(keywords),
+                "duration": infos["duration"],
+                "width": width,
+                "height": height,
+                "size": size,
+                "last_used": time.time(),
+                "terms": sorted(tokenize(query, *tags, *keywords)),
+            }
+            if existing:
+                self._remove(clip_id)
+                if existing["path"] != stored_path and os.path.exists(existing["path"]):
+                    os.remove(existing["path"])
+            self._add(clip_id, entry)
+            self._reload()
+            self._evict(keep=clip_id)
+            self._write()
+            return entry
+
+    def get(self, clip_id):
+        """Returns the current entry for clip_id (which may have been upgraded since), or None."""
+        with self._lock:
+            entry = self.clips.get(clip_id)
+            if entry and not os.path.exists(entry["path"]):
+                self._remove(clip_id)
+                self._save()
+                return None
+            return entry
+
+    def mark_used(self, clip_id):
+        """Records that a clip was just used, so eviction keeps it over colder clips."""
+        with self._lock:
+            entry = self.clips.get(clip_id)
+            if entry:
+                entry["last_used"] = time.time()
+                self._save()
+
+    def _evict(self, keep=None):
+        total = sum(entry.get("size", 0) for entry in self.clips.values())
+        by_age = sorted(self.clips.items(), key=lambda item: item[1].get("last_used", 0))
+        for clip_id, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if clip_id == keep:
+                continue
+            try:
+                os.remove(entry["path"])
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still open elsewhere on Windows; try again next time
+                continue
+            self._remove(clip_id)
+            total -= entry.get("size", 0)
+
+    def search(self, query, min_duration, target_width, target_height, genre="", exclude=(), limit=3):
+        """
+        Returns up to limit (clip_id, entry) pairs matching the query, ranked by keyword
+        overlap, then resolution fit (the smallest clip that covers the frame first).
+        Genre terms don't count towards the overlap: a clip must match at least two of the
+        remaining query terms (or all of them for shorter queries). Clips shorter than
+        min_duration, which would visibly loop, and clip ids in exclude (e.g. already used
+        by this job) are skipped.
+        """
+        query_terms = tokenize(query) - tokenize(genre)
+        if not query_terms:
+            return []
+        required = min(2, len(query_terms))
+
+        with self._lock:
+            # Pick up clips other workers added since we last looked
+            if self._stat_index() != self._index_mtime:
+                self._reload()
+
+            overlap = {}
+            for term in query_terms:
+                for clip_id in self.terms.get(term, ()):
+                    overlap[clip_id] = overlap.get(clip_id, 0) + 1
+
+            ranked = []
+            missing = []
+            for clip_id, matched in overlap.items():
+                if matched < required or clip_id in exclude:
+                    continue
+                entry = self.clips[clip_id]
+                if entry["duration"] < min_duration:
+                    continue
+                fit = resolution_fit(entry["width"], entry["height"], target_width, target_height)
+                if fit < MIN_RESOLUTION_FIT:
+                    continue
+                if not os.path.exists(entry["path"]):
+                    missing.append(clip_id)
+                    continue
+                ranked.append(((-matched, -fit, entry["width"] * entry["height"]), clip_id, entry))
+
+            # Forget clips whose files were cleaned up behind our back
+            if missing:
+                for clip_id in missing:
+                    self._remove(clip_id)
+                self._save()
+
+        ranked.sort(key=lambda item: item[0])
+        return [(clip_id, entry) for _, clip_id, entry in ranked[:limit]]
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import threading
+import time
+from urllib.parse import urlparse
+
+# Models to try, in order of preference
+GEMINI_MODELS = ['gemini-2.0-flash', 'gemini-1.5-flash', 'gemini-pro']
+
+CALL_TIMEOUT = 20        # Seconds before a single LLM call is abandoned
+FAILURE_THRESHOLD = 3    # Consecutive failures before a model's circuit opens
+COOLDOWN = 300           # Seconds an open circuit waits before allowing a trial call
+
+
+class LLMUnavailable(Exception):
+    """Raised when no model could answer, either because all failed or all circuits are open."""
+
+
+def sanitize_endpoint(api_endpoint):
+    """
+    Reduces a pasted URL (e.g. https://host/v1beta/models/x:generateContent) to the
+    bare host[:port] the gRPC client expects; a scheme makes the channel fail to resolve.
+    """
+    if api_endpoint and "://" in api_endpoint:
+        api_endpoint = urlparse(api_endpoint).netloc
+    return api_endpoint or None
+
+
+class ModelCircuit:
+    """
+    Tracks the health of one model.
+    Closed: calls go through. Open: the model is skipped until COOLDOWN has passed.
+    Half-open: after the cooldown exactly one trial call is let through, and its result
+    decides whether the circuit closes again; other callers keep skipping the model meanwhile.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def available(self):
+        if self.opened_at is None:
+            return True
+        return not self.trial_in_flight and time.monotonic() - self.opened_at >= COOLDOWN
+
+    def begin_call(self):
+        """Claims a call slot. Returns False if the model must be skipped; claims the trial when half-open."""
+        if not self.available():
+            return False
+        if self.opened_at is not None:
+            self.trial_in_flight = True
+        return True
+
+    def end_call(self):
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, permanent=False):
+        self.failures += 1
+        if permanent or self.failures >= FAILURE_THRESHOLD or self.opened_at is not None:
+            # A failed trial call re-opens the circuit for another cooldown
+            self.opened_at = time.monotonic()
+
+
+class GeminiClient:
+    """
+    Async Gemini client bound to one (API key, endpoint) pair.
+    Unlike genai.configure it holds no global state, so concurrent requests with
+    different keys don't clobber each other. Blocking calls run in worker threads
+    under a timeout, and per-model circuits remember which models work.
+    """
+
+    def __init__(self, api_key, api_endpoint=None, models=GEMINI_MODELS):
+        self.api_key = api_key
+        self.api_endpoint = sanitize_endpoint(api_endpoint)
+        self.models = list(models)
+        self.circuits = {name: ModelCircuit() for name in self.models}
+        self.preferred = None
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        # Built lazily in a worker thread; the gRPC stack is slow to import
+        with self._client_lock:
+            if self._client is None:
+                import google.ai.generativelanguage as glm
+
+                client_options = {"api_key": self.api_key}
+                if self.api_endpoint:
+                    client_options["api_endpoint"] = self.api_endpoint
+                self._client = glm.GenerativeServiceClient(client_options=client_options)
+            return self._client
+
+    def _generate_blocking(self, model_name, prompt, timeout):
+        response = self._get_client().generate_content(
+            request={"model": f"models/{model_name}", "contents": [{"parts": [{"text": prompt}]}]},
+            retry=None,
+            timeout=timeout,
+        )
+        if not response.candidates:
+            raise ValueError("Empty response (prompt may have been blocked)")
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+    def _models_in_order(self, ignore_circuits=False):
+        """Last known-good model first, then the rest in preference order, skipping open circuits."""
+        ordered = self.models
+        if self.preferred in self.models:
+            ordered = [self.preferred] + [m for m in self.models if m != self.preferred]
+        if ignore_circuits:
+            return ordered
+        return [m for m in ordered if self.circuits[m].available()]
+
+    async def generate(self, prompt, timeout=CALL_TIMEOUT, ignore_circuits=False):
+        """
+        Returns the response text from the first model that answers, or raises LLMUnavailable.
+        ignore_circuits tries every model even if its circuit is open (e.g. to validate a key
+        the user just fixed); the outcome still updates the circuits.
+        """
+        candidates = self._models_in_order(ignore_circuits)
+        if not candidates:
+            raise LLMUnavailable("All Gemini models are temporarily disabled after repeated failures")
+
+        last_error = None
+        for model_name in candidates:
+            circuit = self.circuits[model_name]
+            claimed = False
+            if not ignore_circuits:
+                # Another caller may have claimed the half-open trial since we listed candidates
+                if not circuit.begin_call():
+                    continue
+                claimed = True
+            try:
+                text = await asyncio.wait_for(
+                    asyncio.to_thread(self._generate_blocking, model_name, prompt, timeout),
+                    timeout=timeout,
+                )
+            except Exception as e:
+                last_error = e
+                circuit.record_failure(permanent=_is_permanent_error(e))
+                if self.preferred == model_name:
+                    self.preferred = None
+                print(f"Gemini model {model_name} failed: {e}")
+                continue
+            finally:
+                # Also releases the trial if this call was cancelled without a result
+                if claimed:
+                    circuit.end_call()
+
+            circuit.record_success()
+            self.preferred = model_name
+            return text
+
+        if last_error is None:
+            raise LLMUnavailable("All Gemini models are temporarily disabled after repeated failures")
+        raise LLMUnavailable(f"No Gemini model answered: {last_error}")
+
+
+def _is_permanent_error(error):
+    """A missing model or rejected key won't fix itself, so its circuit opens straight away."""
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (api_exceptions.NotFound, api_exceptions.PermissionDenied, api_exceptions.Unauthenticated))
+
+
+def get_gemini_client(api_key, api_endpoint=None):
+    """Returns the shared client for this (key, endpoint) so model health is remembered across requests."""
+    return _shared_client(api_key, sanitize_endpoint(api_endpoint))
+
+
+@functools.lru_cache(maxsize=32)
+def _shared_client(api_key, api_endpoint):
+    return GeminiClient(api_key, api_endpoint)
@@ -0,0 +1,444 @@
+"""
+Load-test harness for the FastAPI service.
+
+Drives /generate-video, /system-status and /validate-keys concurrently with a
+configurable request mix, against local stand-ins for Pexels, Pixabay,
+Pollinations and (in-process only) Gemini, and reports latency percentiles,
+throughput, error rates and server CPU/RSS over time.
+
+Examples:
+    python load_test.py --concurrency 8 --requests 200 --mix status=6,validate=3,generate=1
+    python load_test.py --mode localhost --concurrency 4 --duration 60
+    python load_test.py --url http://10.0.0.5:8000 --server-pid 1234 --mix status=1
+"""
+import argparse
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT_SENTENCES = [
+    "The sun rises over a quiet mountain lake.",
+    "A fisherman rows his boat through the morning mist.",
+    "Birds scatter across the golden sky!",
+    "In the city, traffic begins to hum.",
+    "Children run laughing through a park.",
+    "Waves crash against the rocky coast.",
+]
+
+
+# --- Local stand-ins for external APIs ---
+
+STUB_CLIP_SIZE = (1280, 720)   # Covers a draft frame, so the footage library accepts stand-in clips
+
+
+def make_stub_media(directory):
+    """Renders the sample clip and image the stand-ins serve."""
+    from moviepy import ColorClip
+    from PIL import Image
+
+    clip_path = os.path.join(directory, "clip.mp4")
+    ColorClip(size=STUB_CLIP_SIZE, color=(40, 90, 140), duration=10).write_videofile(
+        clip_path, fps=24, codec="libx264", preset="ultrafast", logger=None)
+
+    Image.new("RGB", (1024, 1024), (140, 90, 40)).save(os.path.join(directory, "image.jpg"))
+
+
+def make_voiceover(directory):
+    """Renders the voiceover uploaded with /generate-video requests and returns its bytes."""
+    import numpy as np
+    from moviepy import AudioArrayClip
+
+    voiceover_path = os.path.join(directory, "voiceover.mp3")
+    rate = 22050
+    t = np.linspace(0, 6, 6 * rate)
+    tone = np.sin(2 * np.pi * 220 * t) * 0.2
+    AudioArrayClip(np.array([tone, tone]).T, fps=rate).write_audiofile(voiceover_path, logger=None)
+    with open(voiceover_path, "rb") as f:
+        return f.read()
+
+
+def make_stub_handler(media_dir, latency):
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_media(self, name, content_type):
+            path = os.path.join(media_dir, name)
+            size = os.path.getsize(path)
+            start, end = 0, size - 1
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            with open(path, "rb") as f:
+                f.seek(start)
+                try:
+                    self.wfile.write(f.read(end - start + 1))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        def do_GET(self):
+            width, height = STUB_CLIP_SIZE
+            path, _, query = self.path.partition("?")
+            base = f"http://{self.headers.get('Host')}"
+            # Vary clip ids by query so the footage library sees distinct clips
+            clip_id = int(hashlib.md5(query.encode("utf-8")).hexdigest()[:6], 16)
+
+            if path.startswith("/media/"):
+                return self.send_media("clip.mp4", "video/mp4")
+            time.sleep(latency)
+            if path == "/pexels/videos/search":
+                return self.send_json({"videos": [{
+                    "id": clip_id + i,
+                    "url": f"https://www.pexels.com/video/stub-clip-{clip_id + i}/",
+                    "video_files": [{"width": width, "height": height, "link": f"{base}/media/clip.mp4?id={clip_id + i}"}],
+                } for i in range(3)]})
+            if path == "/pexels/v1/curated":
+                return self.send_json({"photos": []})
+            if path == "/pixabay/videos/":
+                return self.send_json({"hits": [{
+                    "id": clip_id + i,
+                    "tags": "stub, clip",
+                    "videos": {"medium": {"width": width, "height": height, "url": f"{base}/media/clip.mp4?id={clip_id + i}"}},
+                } for i in range(3)]})
+            if path == "/pixabay/":
+                return self.send_json({"hits": []})
+            if path.startswith("/pollinations/prompt/"):
+                return self.send_media("image.jpg", "image/jpeg")
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return StubHandler
+
+
+def start_stub_server(media_dir, latency):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(media_dir, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def stub_env(stub_url, storage_dir):
+    """Settings that point main_logic at the stand-ins and keep caches out of the real ones."""
+    return {
+        "PEXELS_API_URL": f"{stub_url}/pexels",
+        "PIXABAY_API_URL": f"{stub_url}/pixabay",
+        "POLLINATIONS_URL": f"{stub_url}/pollinations",
+        "STREAMLINE_RESULT_CACHE_DIR": os.path.join(storage_dir, "results"),
+        "STREAMLINE_LIBRARY_DIR": os.path.join(storage_dir, "library"),
+    }
+
+
+def patch_gemini(latency):
+    """Replaces the Gemini RPC with a canned answer after `latency` seconds (in-process mode only)."""
+    import llm_client
+
+    def fake_generate(self, model_name, prompt, timeout):
+        time.sleep(latency)
+        if "JSON" in prompt:
+            return '{"color": "#FFFFFF", "position": "bottom", "font_mood": "bold"}'
+        return "A cinematic wide shot of a misty landscape at dawn"
+
+    llm_client.GeminiClient._generate_blocking = fake_generate
+
+
+# --- Server resource sampling ---
+
+class ResourceSampler:
+    """Samples CPU% and RSS of a process and all its children (e.g. ffmpeg) at a fixed interval."""
+
+    def __init__(self, pid, interval=1.0):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._procs = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _tree(self):
+        try:
+            procs = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        # Reuse Process objects so cpu_percent measures since the previous sample
+        current = {}
+        for proc in procs:
+            current[proc.pid] = self._procs.get(proc.pid, proc)
+        self._procs = current
+        return list(current.values())
+
+    def _run(self):
+        start = time.monotonic()
+        for proc in self._tree():
+            proc.cpu_percent(None)
+        while not self._stop.wait(self.interval):
+            cpu, rss = 0.0, 0
+            for proc in self._tree():
+                try:
+                    cpu += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.samples.append((time.monotonic() - start, cpu, rss / (1024 * 1024)))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- Load generation ---
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("generate", "status", "validate"):
+            raise ValueError(f"Unknown request type '{name}' in --mix")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def build_request(kind, n, args, voiceover):
+    """Returns (method, path, form data, files) for request number n."""
+    if kind == "status":
+        return "GET", "/system-status", None, None
+    if kind == "validate":
+        data = {"api_key_pexels": "stub", "api_key_pixabay": "stub"}
+        if args.mode == "inprocess":
+            data["api_key_gemini"] = "stub"
+        return "POST", "/validate-keys", data, None
+
+    sentences = random.Random(n).sample(SCRIPT_SENTENCES, args.sentences)
+    if not args.repeat_scripts:
+        # Unique text per request so the result cache doesn't short-circuit the pipeline
+        sentences[-1] = sentences[-1].rstrip(".!?") + f" number {n}."
+    data = {
+        "base_genre": "Nature",
+        "api_key_pexels": "stub",
+        "api_key_pixabay": "stub",
+        "aspect_ratio": "16:9",
+        "quality": args.quality,
+    }
+    if args.mode == "inprocess":
+        data["api_key_gemini"] = "stub"
+    files = {
+        "script": ("script.txt", " ".join(sentences).encode("utf-8"), "text/plain"),
+        "voiceover": ("voiceover.mp3", voiceover, "audio/mpeg"),
+    }
+    return "POST", "/generate-video", data, files
+
+
+async def run_load(client, args, voiceover):
+    weights = parse_mix(args.mix)
+    kinds, kind_weights = list(weights), list(weights.values())
+    results = []
+    counter = iter(range(sys.maxsize))
+    stop_at = time.monotonic() + args.duration if args.duration else None
+
+    async def worker():
+        while True:
+            n = next(counter)
+            if args.requests and n >= args.requests:
+                return
+            if stop_at and time.monotonic() >= stop_at:
+                return
+            kind = random.Random(n).choices(kinds, kind_weights)[0]
+            method, path, data, files = build_request(kind, n, args, voiceover)
+            start = time.perf_counter()
+            error = None
+            try:
+                response = await client.request(method, path, data=data, files=files, timeout=args.timeout)
+                if response.status_code >= 400:
+                    error = f"HTTP {response.status_code}"
+            except Exception as e:
+                error = type(e).__name__
+            results.append({"kind": kind, "latency": time.perf_counter() - start, "error": error, "finished": time.monotonic()})
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results, time.monotonic() - started
+
+
+# --- Reporting ---
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def report(results, elapsed, samples, args):
+    print(f"\n--- Load Test: {args.concurrency} concurrent, mix {args.mix}, {args.mode} ---")
+    print(f"{len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.2f} req/s)\n")
+    print(f"{'endpoint':<10} {'count':>6} {'errors':>7} {'err%':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for kind in sorted({r["kind"] for r in results}):
+        rows = [r for r in results if r["kind"] == kind]
+        errors = [r for r in rows if r["error"]]
+        ok = [r["latency"] for r in rows if not r["error"]] or [float("nan")]
+        print(f"{kind:<10} {len(rows):>6} {len(errors):>7} {100 * len(errors) / len(rows):>5.1f}% {len(rows) / elapsed:>7.2f} "
+              f"{percentile(ok, 50):>7.2f}s {percentile(ok, 95):>7.2f}s {percentile(ok, 99):>7.2f}s {max(ok):>7.2f}s")
+
+    error_kinds = {}
+    for r in results:
+        if r["error"]:
+            error_kinds[r["error"]] = error_kinds.get(r["error"], 0) + 1
+    if error_kinds:
+        print("\nErrors: " + ", ".join(f"{name} x{count}" for name, count in sorted(error_kinds.items())))
+
+    if samples:
+        label = "harness + app" if args.mode == "inprocess" else "server"
+        print(f"\n--- {label} CPU / RSS (process tree) ---")
+        step = max(1, len(samples) // 20)
+        for t, cpu, rss in samples[::step]:
+            print(f"t={t:6.1f}s  cpu {cpu:6.1f}%  rss {rss:8.1f} MB")
+        cpus = [s[1] for s in samples]
+        print(f"cpu avg {sum(cpus) / len(cpus):.1f}% max {max(cpus):.1f}%, rss max {max(s[2] for s in samples):.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "results": results, "samples": samples}, f, indent=2)
+        print(f"\nRaw results written to {args.json}")
+
+
+# --- Entry point ---
+
+def wait_for_server(url, timeout=60):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/system-status", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+async def main(args):
+    import httpx
+
+    work_dir = tempfile.mkdtemp(prefix="streamline_load_")
+    stub_server = None
+    server_proc = None
+
+    try:
+        voiceover = make_voiceover(work_dir)
+        # A server we didn't start talks to whatever APIs it was configured with
+        if not args.url:
+            print("Preparing stand-in media...")
+            make_stub_media(work_dir)
+            stub_server, stub_url = start_stub_server(work_dir, args.api_latency)
+            env = stub_env(stub_url, work_dir)
+
+        if args.mode == "inprocess":
+            os.environ.update(env)
+            sys.path.insert(0, BACKEND_DIR)
+            patch_gemini(args.llm_latency)
+            from app import app
+
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app")
+            pid = os.getpid()
+        else:
+            base_url = args.url
+            pid = args.server_pid
+            if not base_url:
+                port = args.port
+                server_proc = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                    cwd=BACKEND_DIR, env={**os.environ, **env})
+                base_url = f"http://127.0.0.1:{port}"
+                pid = server_proc.pid
+            print(f"Waiting for server at {base_url}...")
+            await asyncio.to_thread(wait_for_server, base_url)
+            client = httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=args.concurrency))
+
+        sampler = ResourceSampler(pid, args.sample_interval) if pid else None
+        if sampler:
+            sampler.start()
+        async with client:
+            results, elapsed = await run_load(client, args, voiceover)
+        if sampler:
+            sampler.stop()
+
+        report(results, elapsed, sampler.samples if sampler else [], args)
+    finally:
+        if server_proc:
+            server_proc.terminate()
+            server_proc.wait()
+        if stub_server:
+            stub_server.shutdown()
+        # Stand-in media, result cache and footage library; GBs after long runs
+        if args.keep:
+            print(f"Kept working files in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "localhost"], default="inprocess",
+                        help="drive the app in this process, or as a uvicorn server over localhost")
+    parser.add_argument("--url", help="target an already running server instead (implies --mode localhost, no stand-ins)")
+    parser.add_argument("--server-pid", type=int, help="PID to sample CPU/RSS from when using --url")
+    parser.add_argument("--port", type=int, default=8765, help="port for the uvicorn server in localhost mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous in-flight requests")
+    parser.add_argument("--requests", type=int, default=40, help="total requests to send (0 = until --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="stop sending after this many seconds")
+    parser.add_argument("--mix", default="generate=1,status=4,validate=2", help="weighted request mix")
+    parser.add_argument("--quality", choices=["draft", "final"], default="draft", help="quality for /generate-video")
+    parser.add_argument("--sentences", type=int, default=2, help="scenes per generated script")
+    parser.add_argument("--repeat-scripts", action="store_true", help="reuse scripts so the result cache is exercised")
+    parser.add_argument("--api-latency", type=float, default=0.1, help="stand-in Pexels/Pixabay/Pollinations latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stand-in Gemini latency (s, in-process only)")
+    parser.add_argument("--timeout", type=float, default=600, help="per-request timeout (s)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="CPU/RSS sampling interval (s)")
+    parser.add_argument("--json", help="also write raw results and samples to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory for inspection")
+    args = parser.parse_args(argv)
+    if args.requests <= 0 and args.duration <= 0:
+        parser.error("--requests 0 needs a --duration, or the run would never end")
+    if args.url:
+        args.mode = "localhost"
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
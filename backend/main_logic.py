@@ -2,22 +2,66 @@ import os
 import tempfile
 import requests
 import random
-import yake
+import hashlib
 import asyncio
-import edge_tts
-try:
-    import torch
-except ImportError:
-    torch = None
-except OSError:
-    torch = None
-from moviepy import VideoFileClip, AudioFileClip, concatenate_videoclips, ColorClip, TextClip, CompositeVideoClip, vfx, ImageClip, CompositeAudioClip, afx
-
+import threading
+import time
+import functools
+import importlib.util
 import subprocess
-import google.generativeai as genai
 import urllib.parse
+from collections import OrderedDict
+from llm_client import get_gemini_client
+from result_cache import ResultCache, make_job_key
+from footage_library import FootageLibrary, MIN_RESOLUTION_FIT, resolution_fit
+
+# Heavy dependencies (torch, moviepy, the Gemini SDK, edge_tts, yake) are
+# imported inside the functions that use them so that importing this module,
+# and therefore booting app.py, stays fast and lean. See check_startup.py.
+
+# External services; overridable so load_test.py can point them at local stand-ins
+PEXELS_API_URL = os.getenv("PEXELS_API_URL", "https://api.pexels.com")
+PIXABAY_API_URL = os.getenv("PIXABAY_API_URL", "https://pixabay.com/api")
+POLLINATIONS_URL = os.getenv("POLLINATIONS_URL", "https://image.pollinations.ai")
+
+# Hedged scene asset resolution (see resolve_scene_clip)
+SCENE_DEADLINE = 60     # Seconds a scene may spend resolving footage before the colour fallback
+HEDGE_DELAY = 3         # Start the AI image fallback if stock search takes longer than this...
+MIN_STOCK_HITS = 2      # ...or returns fewer candidates than this
+DOWNLOAD_TIMEOUT = 30   # Connect/read timeout for asset downloads
+SEARCH_TIMEOUT = 10     # Connect/read timeout for stock searches; a hung one would pin a worker thread
+
+# Partial stock downloads (see download_clip_head)
+PARTIAL_DOWNLOADS = True
+HEAD_MARGIN = 2         # Seconds fetched beyond what the scene needs
+PROBE_BYTES = 4096      # Leading bytes checked for a video container before committing to a download
+# ffmpeg errors meaning the URL couldn't be opened or fetched (worth a plain download),
+# as opposed to a file ffmpeg read and rejected
+FFMPEG_INPUT_ERRORS = (
+    "Protocol not found", "Server returned", "Connection", "Input/output error",
+    "Operation not permitted", "Failed to resolve", "timed out", "Network is unreachable",
+)
+
+# Output settings per render quality. Drafts keep the scene plan and timing of the
+# final render but cut pixels, frames and encoder effort for a fast preview.
+RENDER_PROFILES = {
+    "final": {"height": 1080, "fps": 24},
+    "draft": {"height": 480, "fps": 12},
+}
 
-def get_smart_styling(text, genre, api_key_gemini, api_endpoint_gemini=None):
+# Assets and subtitle styles picked by draft renders, keyed by (sentence, genre, seed), so
+# the follow-up final render shows exactly what the preview showed.
+MAX_REMEMBERED_SCENES = 512
+_scene_memory = OrderedDict()
+
+# Finished videos by job hash, and futures for jobs currently rendering
+_result_cache = ResultCache()
+_jobs_in_flight = {}
+
+# Stock clips downloaded so far, searched before any provider API
+_footage_library = FootageLibrary()
+
+async def get_smart_styling(text, genre, api_key_gemini, api_endpoint_gemini=None):
     """
     Uses Gemini to determine the best font color, position, and style.
     Returns a dict with styling options.
@@ -30,22 +74,6 @@ def get_smart_styling(text, genre, api_key_gemini, api_endpoint_gemini=None):
         }
     
     try:
-        config_args = {"api_key": api_key_gemini}
-        if api_endpoint_gemini:
-            # Sanitize endpoint
-            if "googleapis.com" in api_endpoint_gemini and "/models/" in api_endpoint_gemini:
-                 from urllib.parse import urlparse
-                 parsed = urlparse(api_endpoint_gemini)
-                 api_endpoint_gemini = f"{parsed.scheme}://{parsed.netloc}"
-            config_args["client_options"] = {"api_endpoint": api_endpoint_gemini}
-        
-        genai.configure(**config_args)
-        
-        # Try models in order
-        models_to_try = ['gemini-2.0-flash', 'gemini-1.5-flash', 'gemini-pro']
-        model = None
-        response = None
-        
         prompt = f"""
         Analyze this sentence for a video in the '{genre}' genre: "{text}"
         Determine the best subtitle styling.
@@ -55,21 +83,12 @@ def get_smart_styling(text, genre, api_key_gemini, api_endpoint_gemini=None):
         - "font_mood": "bold", "playful", or "elegant".
         """
 
-        for model_name in models_to_try:
-            try:
-                m = genai.GenerativeModel(model_name)
-                response = m.generate_content(prompt)
-                if response:
-                    break
-            except:
-                continue
-        
-        if not response:
-             return {"color": "#FFD700", "position": "center", "font": "Arial"}
+        # Shared client skips models known to be failing and keeps the event loop free
+        response_text = await get_gemini_client(api_key_gemini, api_endpoint_gemini).generate(prompt)
 
         import json
         # Clean response of markdown code blocks if present
-        clean_text = response.text.replace("```json", "").replace("```", "").strip()
+        clean_text = response_text.replace("```json", "").replace("```", "").strip()
         styling = json.loads(clean_text)
         
         # Map font_mood to actual fonts (assuming Windows standard fonts for now)
@@ -85,26 +104,53 @@ def get_smart_styling(text, genre, api_key_gemini, api_endpoint_gemini=None):
         print(f"Gemini Styling Error: {e}")
         return {"color": "#FFD700", "position": "center", "font": "Arial"}
 
-def generate_fallback_image(prompt):
+def derive_seed(seed, *parts):
+    """
+    Derives a stable sub-seed for one scene and purpose from a job seed, or None if the job
+    is unseeded. Sub-seeds fix the stock shuffle and the Pollinations seed per scene;
+    resolve_scene_clip also turns off the speculative hedge and the footage library for
+    seeded jobs so which source wins doesn't depend on timing or earlier jobs.
+    """
+    if seed is None:
+        return None
+    digest = hashlib.sha256(repr((seed,) + parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % 1000000
+
+def generate_fallback_image(prompt, cancel_event=None, seed=None):
     """
     Generates an image using Pollinations.ai based on the prompt.
     Returns the path to the downloaded image.
     """
     try:
-        # Add random seed to ensure uniqueness even for same prompt
-        seed = random.randint(0, 999999)
+        # Add random seed to ensure uniqueness even for same prompt, unless the job is seeded
+        if seed is None:
+            seed = random.randint(0, 999999)
         encoded_prompt = urllib.parse.quote(prompt)
-        url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?seed={seed}"
-        return download_file(url, suffix=".jpg")
+        url = f"{POLLINATIONS_URL}/prompt/{encoded_prompt}?seed={seed}"
+        return download_file(url, suffix=".jpg", cancel_event=cancel_event)
     except Exception as e:
         print(f"Image Gen Error: {e}")
         return None
 
+def cuda_available():
+    """Checks CUDA through torch, importing it only if it is installed."""
+    if importlib.util.find_spec("torch") is None:
+        return False
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except (ImportError, OSError):
+        return False
+
+@functools.lru_cache(maxsize=None)
 def get_hardware_device():
-    """Detects GPU using wmic (Windows) to support NVIDIA, AMD, and Intel."""
+    """
+    Detects GPU using wmic (Windows) to support NVIDIA, AMD, and Intel.
+    The result is cached: hardware doesn't change at runtime and torch/wmic are slow to start.
+    """
     try:
         # Check for NVIDIA via torch first (fastest if working)
-        if torch and torch.cuda.is_available():
+        if cuda_available():
             return "GPU (NVIDIA CUDA)"
         
         # Fallback to WMIC for broader support (AMD/Intel/NVIDIA without CUDA)
@@ -129,6 +175,22 @@ def get_hardware_device():
 
 
 
+def get_target_size(aspect_ratio, quality="final"):
+    """Returns (width, height) of the output frame, e.g. 1920x1080 final or 854x480 draft."""
+    short_side = RENDER_PROFILES[quality]["height"]
+    long_side = round(short_side * 16 / 9 / 2) * 2 # Encoders need even dimensions
+    if aspect_ratio == "9:16":
+        return short_side, long_side
+    return long_side, short_side
+
+def remember_scene(scene_key, **entries):
+    """Records the asset and/or style resolved for a scene, evicting the oldest scenes past the limit."""
+    scene = _scene_memory.pop(scene_key, {})
+    scene.update(entries)
+    _scene_memory[scene_key] = scene
+    while len(_scene_memory) > MAX_REMEMBERED_SCENES:
+        _scene_memory.popitem(last=False)
+
 async def generate_audio_from_text(text, voice="en-US-AriaNeural"):
     """Generates audio from text using Edge-TTS."""
     # Map friendly names to actual Edge-TTS voices
@@ -145,6 +207,8 @@ async def generate_audio_from_text(text, voice="en-US-AriaNeural"):
     if not selected_voice:
         selected_voice = "en-US-AriaNeural"
 
+    import edge_tts
+
     print(f"Generating audio with voice: {selected_voice}")
     communicate = edge_tts.Communicate(text, selected_voice)
     with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
@@ -153,77 +217,520 @@ async def generate_audio_from_text(text, voice="en-US-AriaNeural"):
 
 def get_keywords(text, max_keywords=3):
     """Extract keywords from text using YAKE."""
+    import yake
+
     kw_extractor = yake.KeywordExtractor(lan="en", n=2, dedupLim=0.9, top=max_keywords, features=None)
     keywords = kw_extractor.extract_keywords(text)
     return [kw[0] for kw in keywords]
 
 def fetch_pexels_videos(query, api_key, per_page=3):
-    """Fetch video URLs from Pexels API."""
+    """
+    Fetch video candidates from Pexels API.
+    Each candidate is {"id": ..., "tags": [...], "renditions": [(width, height, url), ...]}, see pick_rendition.
+    """
     if not api_key:
         return []
     headers = {'Authorization': api_key}
-    url = f"https://api.pexels.com/videos/search?query={query}&per_page={per_page}"
+    url = f"{PEXELS_API_URL}/videos/search?query={query}&per_page={per_page}"
     try:
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=SEARCH_TIMEOUT)
         response.raise_for_status()
         data = response.json()
-        video_urls = []
+        candidates = []
         for video in data.get('videos', []):
-            video_files = video.get('video_files', [])
-            if video_files:
-                video_files.sort(key=lambda x: x.get('width', 0), reverse=True)
-                video_urls.append(video_files[0]['link'])
-        return video_urls
+            renditions = [
+                (f.get('width') or 0, f.get('height') or 0, f['link'])
+                for f in video.get('video_files', []) if f.get('link')
+            ]
+            if renditions:
+                # Pexels rarely fills in tags, but the page slug describes the clip
+                tags = [t.get('name', '') if isinstance(t, dict) else t for t in video.get('tags', [])]
+                tags.append(video.get('url', '').rstrip('/').split('/')[-1])
+                candidates.append({"id": f"pexels:{video.get('id')}", "tags": tags, "renditions": renditions})
+        return candidates
     except Exception as e:
         print(f"Error fetching Pexels videos: {e}")
         return []
 
 def fetch_pixabay_videos(query, api_key, per_page=3):
-    """Fetch video URLs from Pixabay API."""
+    """Fetch video candidates from Pixabay API, in the same shape as fetch_pexels_videos."""
     if not api_key:
         return []
-    url = f"https://pixabay.com/api/videos/?key={api_key}&q={query}&per_page={per_page}"
+    url = f"{PIXABAY_API_URL}/videos/?key={api_key}&q={query}&per_page={per_page}"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=SEARCH_TIMEOUT)
         response.raise_for_status()
         data = response.json()
-        video_urls = []
+        candidates = []
         for hit in data.get('hits', []):
-            videos = hit.get('videos', {})
-            if 'large' in videos:
-                video_urls.append(videos['large']['url'])
-            elif 'medium' in videos:
-                video_urls.append(videos['medium']['url'])
-        return video_urls
+            renditions = [
+                (v.get('width') or 0, v.get('height') or 0, v['url'])
+                for v in hit.get('videos', {}).values() if v.get('url')
+            ]
+            if renditions:
+                tags = [t.strip() for t in hit.get('tags', '').split(',') if t.strip()]
+                candidates.append({"id": f"pixabay:{hit.get('id')}", "tags": tags, "renditions": renditions})
+        return candidates
     except Exception as e:
         print(f"Error fetching Pixabay videos: {e}")
         return []
 
-def download_file(url, suffix=".mp4"):
-    """Download a file from a URL to a temporary file."""
+def pick_rendition(candidate, target_width, target_height, quality="final"):
+    """
+    Chooses which file of a stock video to download.
+    Final renders take the largest rendition. Drafts take the smallest one that still
+    covers the target frame, so previews don't pull 4K files.
+    """
+    renditions = sorted(candidate["renditions"], key=lambda r: r[0] * r[1])
+    if quality == "draft":
+        for width, height, url in renditions:
+            if width >= target_width and height >= target_height:
+                return url
+    return renditions[-1][2]
+
+def download_file(url, suffix=".mp4", cancel_event=None):
+    """Download a file from a URL to a temporary file. Aborts early if cancel_event is set."""
     try:
+        cancelled = False
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            response = requests.get(url, stream=True)
+            response = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
             response.raise_for_status()
             for chunk in response.iter_content(chunk_size=8192):
+                if cancel_event and cancel_event.is_set():
+                    cancelled = True
+                    response.close()
+                    break
                 tmp.write(chunk)
-            return tmp.name
+        if cancelled:
+            os.remove(tmp.name)
+            return None
+        return tmp.name
     except Exception as e:
         print(f"Error downloading file {url}: {e}")
         return None
 
-async def generate_video(script_text, voiceover_file, competitor_url, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini=None, aspect_ratio="16:9", voice_name="Female (Default)", background_music_file=None, bg_music_volume=0.1):
+def looks_like_video(head):
+    """Checks the leading bytes of a file for an MP4/MOV box or a WebM/Matroska header."""
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return True
+    return len(head) >= 8 and head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip")
+
+def probe_video_url(url):
+    """
+    Fetches only the first PROBE_BYTES of a URL (via a Range request where supported)
+    and reports whether they look like a video container.
+    """
+    try:
+        response = requests.get(url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        try:
+            response.raise_for_status()
+            head = b""
+            for chunk in response.iter_content(chunk_size=PROBE_BYTES):
+                head += chunk
+                if len(head) >= PROBE_BYTES:
+                    break
+        finally:
+            response.close()
+        return looks_like_video(head)
+    except Exception as e:
+        print(f"Error probing {url}: {e}")
+        return False
+
+def download_clip_head(url, seconds, cancel_event=None):
+    """
+    Downloads only the leading `seconds` (+ HEAD_MARGIN) of a remote video.
+    The container is validated from the first few KB so bad candidates are dropped early,
+    then ffmpeg stream-copies the needed segment straight from the URL, issuing range
+    requests as it goes instead of pulling the whole file. Falls back to download_file
+    only if ffmpeg couldn't open or fetch the URL; a file ffmpeg read and rejected is
+    dropped. Returns the local path, or None.
+    """
+    if not probe_video_url(url):
+        print(f"Skipping {url}: not a video container")
+        return None
+    if cancel_event and cancel_event.is_set():
+        return None
+
+    import imageio_ffmpeg
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
+        out_path = tmp.name
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+        "-rw_timeout", str(DOWNLOAD_TIMEOUT * 1000000),
+        "-i", url,
+        "-t", f"{seconds + HEAD_MARGIN:.2f}",
+        "-map", "0:v:0", "-an", "-c", "copy", "-movflags", "+faststart",
+        out_path,
+    ]
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + DOWNLOAD_TIMEOUT * 2
+        while proc.poll() is None:
+            if (cancel_event and cancel_event.is_set()) or time.monotonic() > deadline:
+                proc.kill()
+                proc.wait()
+                os.remove(out_path)
+                return None
+            time.sleep(0.05)
+        if proc.returncode == 0 and os.path.getsize(out_path) > 0:
+            return out_path
+        error = proc.stderr.read().decode(errors='replace').strip()
+        print(f"Partial download failed for {url}: {error}")
+        fall_back = any(marker in error for marker in FFMPEG_INPUT_ERRORS)
+    except Exception as e:
+        # ffmpeg itself couldn't run
+        print(f"Partial download failed for {url}: {e}")
+        fall_back = True
+
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    if not fall_back:
+        return None
+    return download_file(url, cancel_event=cancel_event)
+
+def search_stock_videos(query, api_key_pexels, api_key_pixabay, seed=None):
+    """Search every configured stock provider and return the candidates in random (or seeded) order."""
+    candidates = []
+    if api_key_pexels:
+        candidates.extend(fetch_pexels_videos(query, api_key_pexels))
+    if api_key_pixabay:
+        candidates.extend(fetch_pixabay_videos(query, api_key_pixabay))
+
+    random.Random(seed).shuffle(candidates)
+    return candidates
+
+@functools.lru_cache(maxsize=32)
+def cover_fit_maps(src_width, src_height, target_width, target_height):
+    """
+    Computes where a source frame is sampled to cover the target and centre-crop it:
+    the crop window in source pixels, which is resampled straight to the target size.
+    Cached per (source size, target size) since every frame of a clip, and often every
+    clip of a job, shares it. Returns an integer (x, y) offset when no resampling is
+    needed (the source already matches one target side), else the crop box.
+    """
+    scale = max(target_width / src_width, target_height / src_height)
+    if scale == 1:
+        return (src_width - target_width) // 2, (src_height - target_height) // 2
+
+    crop_width = target_width / scale
+    crop_height = target_height / scale
+    left = (src_width - crop_width) / 2
+    top = (src_height - crop_height) / 2
+    return left, top, left + crop_width, top + crop_height
+
+def apply_cover_fit(frame, crop, target_width, target_height):
+    """Scales and crops one frame (RGB, RGBA or float mask) using a window from cover_fit_maps."""
+    import numpy as np
+    from PIL import Image
+
+    if len(crop) == 2:
+        x0, y0 = crop
+        return frame[y0:y0 + target_height, x0:x0 + target_width]
+
+    is_mask = frame.dtype != np.uint8
+    image = Image.fromarray(frame.astype(np.float32) if is_mask else frame)
+    # Only the pixels inside the crop box are read, in a single Lanczos pass
+    # (the filter vfx.Resize used), so nothing outside the final frame is resampled
+    resized = image.resize((target_width, target_height), Image.Resampling.LANCZOS, box=crop)
+    if is_mask:
+        return np.clip(np.asarray(resized), 0, 1)
+    return np.asarray(resized)
+
+def cover_fit(clip, target_width, target_height):
+    """
+    Scales a clip to cover the target size and centre-crops it with a single resample
+    per frame, instead of up to two full-frame resizes followed by a crop.
+    Works for video and ImageClip (which transforms its image once), masks included.
+    """
+    if tuple(clip.size) == (target_width, target_height):
+        return clip
+    crop = cover_fit_maps(clip.w, clip.h, target_width, target_height)
+    return clip.image_transform(lambda frame: apply_cover_fit(frame, crop, target_width, target_height), apply_to=["mask"])
+
+def fit_video_clip(video_path, sentence_duration, target_width, target_height):
+    """Opens a video file fitted to the target size and scene duration."""
+    from moviepy import VideoFileClip
+
+    clip = VideoFileClip(video_path)
+
+    # Scale to cover the frame and centre-crop in one pass
+    clip = cover_fit(clip, target_width, target_height)
+
+    # Loop if too short
+    if clip.duration < sentence_duration:
+        clip = clip.loop(duration=sentence_duration)
+    else:
+        clip = clip.subclipped(0, sentence_duration)
+    return clip
+
+def load_stock_clip(candidates, sentence_duration, target_width, target_height, quality="final", cancel_event=None):
+    """
+    Downloads candidates in turn until one opens as a usable clip.
+    Returns (clip, asset) with the clip fitted to the target size and scene duration, or None.
+    """
+    for candidate in candidates:
+        if cancel_event and cancel_event.is_set():
+            return None
+        url = pick_rendition(candidate, target_width, target_height, quality)
+        if PARTIAL_DOWNLOADS:
+            video_path = download_clip_head(url, sentence_duration, cancel_event=cancel_event)
+        else:
+            video_path = download_file(url, cancel_event=cancel_event)
+        if video_path:
+            try:
+                clip = fit_video_clip(video_path, sentence_duration, target_width, target_height)
+
+                # Lost the race while we were decoding
+                if cancel_event and cancel_event.is_set():
+                    clip.close()
+                    return None
+                return clip, {"kind": "stock", "candidate": candidate, "path": video_path}
+            except Exception as e:
+                print(f"Error processing clip: {e}")
+    return None
+
+def load_library_clip(query, sentence_duration, target_width, target_height, genre="", exclude=()):
+    """
+    Opens the best match for the query from the local footage library, skipping clip ids
+    in exclude. Returns (clip, asset) or None.
+    """
+    for clip_id, entry in _footage_library.search(query, sentence_duration, target_width, target_height, genre, exclude):
+        try:
+            clip = fit_video_clip(entry["path"], sentence_duration, target_width, target_height)
+            _footage_library.mark_used(clip_id)
+            print(f"Using library footage {clip_id} ({entry['width']}x{entry['height']})")
+            return clip, {"kind": "library", "clip_id": clip_id, "path": entry["path"]}
+        except Exception as e:
+            print(f"Error opening library clip {clip_id}: {e}")
+    return None
+
+def load_image_clip(img_path, sentence_duration, target_width, target_height):
+    """Opens a still image as a clip fitted to the target size."""
+    from moviepy import ImageClip
+
+    img_clip = ImageClip(img_path).with_duration(sentence_duration)
+    # Scale image to cover the target and centre-crop
+    return cover_fit(img_clip, target_width, target_height)
+
+async def generate_ai_image_clip(sentence, base_genre, api_key_gemini, api_endpoint_gemini, sentence_duration, target_width, target_height, cancel_event=None, seed=None):
+    """
+    Asks Gemini for an image prompt and renders it with Pollinations.
+    Returns (clip, asset) with an ImageClip fitted to the target size, or None.
+    """
+    try:
+        # Get prompt from Gemini
+        prompt_req = f"Create a vivid, cinematic image prompt for this scene: '{sentence}'. Genre: {base_genre}. Keep it under 20 words."
+        img_prompt = (await get_gemini_client(api_key_gemini, api_endpoint_gemini).generate(prompt_req)).strip()
+        if cancel_event and cancel_event.is_set():
+            return None
+        print(f"Generated Image Prompt: {img_prompt}")
+
+        img_path = await asyncio.to_thread(generate_fallback_image, img_prompt, cancel_event, seed)
+        if not img_path or (cancel_event and cancel_event.is_set()):
+            return None
+
+        img_clip = await asyncio.to_thread(load_image_clip, img_path, sentence_duration, target_width, target_height)
+        return img_clip, {"kind": "image", "path": img_path}
+    except Exception as e:
+        print(f"AI Image Fallback Failed: {e}")
+        return None
+
+async def reuse_scene_asset(asset, sentence_duration, target_width, target_height, quality="final"):
+    """Rebuilds a scene clip from an asset resolved by an earlier render. Returns (clip, asset) or None."""
+    if asset["kind"] == "stock":
+        return await asyncio.to_thread(load_stock_clip, [asset["candidate"]], sentence_duration, target_width, target_height, quality)
+    if asset["kind"] == "library":
+        # A clip picked for a draft may be too small for the final frame; resolve afresh then
+        entry = _footage_library.get(asset["clip_id"])
+        if entry and resolution_fit(entry["width"], entry["height"], target_width, target_height) >= MIN_RESOLUTION_FIT:
+            try:
+                clip = await asyncio.to_thread(fit_video_clip, entry["path"], sentence_duration, target_width, target_height)
+                _footage_library.mark_used(asset["clip_id"])
+                return clip, {"kind": "library", "clip_id": asset["clip_id"], "path": entry["path"]}
+            except Exception as e:
+                print(f"Error reusing library clip: {e}")
+    if asset["kind"] == "image" and os.path.exists(asset["path"]):
+        try:
+            img_clip = await asyncio.to_thread(load_image_clip, asset["path"], sentence_duration, target_width, target_height)
+            return img_clip, asset
+        except Exception as e:
+            print(f"Error reusing image asset: {e}")
+    return None
+
+async def resolve_scene_clip(sentence, sentence_duration, search_query, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini, target_width, target_height, quality="final", seed=None, keywords=(), used_clips=()):
+    """
+    Resolves the visual for one scene, from the local footage library if it has a match
+    not in used_clips (clips earlier scenes of the job showed), otherwise with a hedged strategy.
+    The AI image fallback starts speculatively when the stock search is slow (HEDGE_DELAY)
+    or returns fewer than MIN_STOCK_HITS candidates, instead of only after every stock
+    download has failed. The first usable clip wins and the losing candidate is cancelled.
+    Returns (clip, asset), or None if nothing usable arrives within SCENE_DEADLINE seconds.
+    Stock clips that win are ingested into the library for later scenes and jobs.
+
+    Seeded jobs skip the library and the speculative hedge: stock is tried first and the AI
+    image only after every stock candidate failed, so the same inputs pick the same source
+    (barring provider changes or the deadline).
+    """
+    seeded = seed is not None
+
+    # Footage already on disk beats any API call or download
+    if not seeded:
+        local = await asyncio.to_thread(load_library_clip, search_query, sentence_duration, target_width, target_height, base_genre, used_clips)
+        if local:
+            return local
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SCENE_DEADLINE
+    hedge_at = loop.time() + HEDGE_DELAY if api_key_gemini and not seeded else None
+    cancel_event = threading.Event()
+    racers = set()
+    ai_task = None
+
+    def start_ai_fallback(reason):
+        nonlocal ai_task, hedge_at
+        hedge_at = None
+        if ai_task or not api_key_gemini:
+            return
+        print(f"Starting AI image fallback early: {reason}")
+        ai_task = asyncio.create_task(generate_ai_image_clip(
+            sentence, base_genre, api_key_gemini, api_endpoint_gemini,
+            sentence_duration, target_width, target_height, cancel_event,
+            derive_seed(seed, sentence, "image")
+        ))
+        racers.add(ai_task)
+
+    search_task = asyncio.create_task(asyncio.to_thread(search_stock_videos, search_query, api_key_pexels, api_key_pixabay, derive_seed(seed, sentence, "stock")))
+    racers.add(search_task)
+    winner = None
+
+    try:
+        while racers and not winner:
+            now = loop.time()
+            if now >= deadline:
+                print(f"Scene deadline of {SCENE_DEADLINE}s reached, no asset resolved in time")
+                break
+
+            timeout = deadline - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(hedge_at - now, 0))
+
+            done, racers = await asyncio.wait(racers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if hedge_at is not None and loop.time() >= hedge_at:
+                start_ai_fallback("stock search is slow")
+
+            for task in done:
+                result = None
+                if not task.cancelled() and task.exception() is None:
+                    result = task.result()
+                elif not task.cancelled():
+                    print(f"Scene asset task failed: {task.exception()}")
+
+                if task is search_task:
+                    candidates = result or []
+                    if len(candidates) < MIN_STOCK_HITS and not (seeded and candidates):
+                        start_ai_fallback(f"only {len(candidates)} stock hits")
+                    hedge_at = None
+                    if candidates:
+                        racers.add(asyncio.create_task(asyncio.to_thread(
+                            load_stock_clip, candidates, sentence_duration, target_width, target_height, quality, cancel_event
+                        )))
+                elif result is not None:
+                    if winner is None:
+                        winner = result
+                    else:
+                        # Both finished in the same tick; keep the first
+                        result[0].close()
+                elif task is not ai_task:
+                    # Every stock candidate failed, fall back the old way
+                    start_ai_fallback("no usable stock clip")
+    finally:
+        # Cancel the losers; worker threads notice the event and clean up after themselves
+        cancel_event.set()
+        for task in racers:
+            task.cancel()
+
+    if winner and winner[1]["kind"] == "stock":
+        asset = winner[1]
+        try:
+            await asyncio.to_thread(
+                _footage_library.ingest, asset["path"], asset["candidate"]["id"],
+                asset["candidate"].get("tags", ()), search_query, keywords
+            )
+        except Exception as e:
+            print(f"Footage library ingest failed: {e}")
+
+    return winner
+
+async def generate_video(script_text, voiceover_file, competitor_url, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini=None, aspect_ratio="16:9", voice_name="Female (Default)", background_music_file=None, bg_music_volume=0.1, quality="final", seed=None, use_cache=True):
+    """
+    Generates a video, returning a stored copy if an identical job already finished.
+    Identical jobs submitted while one is rendering wait for it instead of rendering twice.
+    seed makes stock selection and AI image generation reproducible for cache misses.
+    Renders where a scene fell back to the colour card aren't cached, so a retry gets a fresh attempt.
+    """
+    if not use_cache:
+        output_path, _ = await render_video(script_text, voiceover_file, competitor_url, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini, aspect_ratio, voice_name, background_music_file, bg_music_volume, quality, seed)
+        return output_path
+
+    # Keys themselves don't change the output, only which providers are available
+    job_key = make_job_key(
+        script_text=script_text, voiceover_file=voiceover_file, competitor_url=competitor_url,
+        base_genre=base_genre, aspect_ratio=aspect_ratio, voice_name=voice_name,
+        background_music_file=background_music_file, bg_music_volume=bg_music_volume,
+        quality=quality, seed=seed,
+        providers=(bool(api_key_pexels), bool(api_key_pixabay), bool(api_key_gemini))
+    )
+
+    while True:
+        # Loop so that if the render we waited on failed, only one waiter takes over
+        while job_key in _jobs_in_flight:
+            print("Identical job already rendering, waiting for it...")
+            await asyncio.shield(_jobs_in_flight[job_key])
+
+        # Reading may copy a whole video, so keep it off the event loop
+        cached_path = await asyncio.to_thread(_result_cache.get, job_key)
+        if cached_path:
+            print(f"Result cache hit for job {job_key[:12]}")
+            return cached_path
+        # An identical job may have started while we were reading the cache
+        if job_key not in _jobs_in_flight:
+            break
+
+    done = asyncio.get_running_loop().create_future()
+    _jobs_in_flight[job_key] = done
+    try:
+        output_path, degraded = await render_video(script_text, voiceover_file, competitor_url, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini, aspect_ratio, voice_name, background_music_file, bg_music_volume, quality, seed)
+        if degraded:
+            print(f"Not caching job {job_key[:12]}: some scenes used the colour fallback")
+        else:
+            await asyncio.to_thread(_result_cache.put, job_key, output_path)
+        return output_path
+    finally:
+        _jobs_in_flight.pop(job_key, None)
+        done.set_result(None)
+
+async def render_video(script_text, voiceover_file, competitor_url, base_genre, api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini=None, aspect_ratio="16:9", voice_name="Female (Default)", background_music_file=None, bg_music_volume=0.1, quality="final", seed=None):
     """
     Generates a video based on the script and voiceover.
+    quality="draft" renders a fast low-resolution preview with the same scene plan and
+    timing; a later final render of the same script reuses the draft's assets and styles.
+    Returns (output_path, degraded), degraded being True if any scene used the colour fallback.
     """
+    from moviepy import AudioFileClip, concatenate_videoclips, ColorClip, TextClip, CompositeVideoClip, CompositeAudioClip, afx
+
     device = get_hardware_device()
     print(f"Starting video generation on {device} for genre: {base_genre}")
     
+    if quality not in RENDER_PROFILES:
+        raise ValueError(f"Unknown quality '{quality}', expected one of {list(RENDER_PROFILES)}")
+
     # Determine dimensions
-    if aspect_ratio == "9:16":
-        target_width, target_height = 1080, 1920
-    else:
-        target_width, target_height = 1920, 1080
+    target_width, target_height = get_target_size(aspect_ratio, quality)
+    fps = RENDER_PROFILES[quality]["fps"]
+    # Subtitle sizes below were tuned for 1080p
+    text_scale = min(target_width, target_height) / 1080
     
     audio_path = None
     
@@ -255,108 +762,47 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
         
         clips = []
         current_time = 0
+        degraded = False
+        used_clips = set() # Library clip ids shown so far, so recurring topics don't repeat one clip
         
         for sentence in sentences:
             sentence_duration = (len(sentence) / total_chars) * duration
             print(f"Processing scene: '{sentence[:30]}...' ({sentence_duration:.2f}s)")
             
-            keywords = get_keywords(sentence)
-            video_urls = []
-            
-            # Search for clips
-            search_query = f"{base_genre} {' '.join(keywords)}"
-            if api_key_pexels:
-                video_urls.extend(fetch_pexels_videos(search_query, api_key_pexels))
-            if api_key_pixabay:
-                video_urls.extend(fetch_pixabay_videos(search_query, api_key_pixabay))
-            
-            random.shuffle(video_urls)
-            
+            scene_key = (sentence, base_genre, seed)
+            remembered = _scene_memory.get(scene_key, {})
+            resolved = None
+
+            # Reuse what a draft of this script already resolved
+            if remembered.get("asset"):
+                resolved = await reuse_scene_asset(remembered["asset"], sentence_duration, target_width, target_height, quality)
+
+            if not resolved:
+                keywords = get_keywords(sentence)
+                search_query = f"{base_genre} {' '.join(keywords)}"
+
+                # Race stock footage against the AI image fallback under a per-scene deadline
+                resolved = await resolve_scene_clip(
+                    sentence, sentence_duration, search_query, base_genre,
+                    api_key_pexels, api_key_pixabay, api_key_gemini, api_endpoint_gemini,
+                    target_width, target_height, quality, seed, keywords, used_clips
+                )
+
             scene_clip = None
-            
-            # Try to find a valid video clip
-            for url in video_urls:
-                video_path = download_file(url)
-                if video_path:
-                    try:
-                        clip = VideoFileClip(video_path)
-                        
-                        # Resize logic for aspect ratio
-                        if aspect_ratio == "9:16":
-                            # Vertical crop
-                            clip = clip.with_effects([vfx.Resize(height=target_height)])
-                            if clip.w < target_width:
-                                clip = clip.with_effects([vfx.Resize(width=target_width)])
-                            clip = clip.cropped(x1=clip.w/2 - target_width/2, width=target_width, height=target_height)
-                        else:
-                            # Landscape
-                            clip = clip.with_effects([vfx.Resize(height=target_height)])
-                            if clip.w < target_width:
-                                clip = clip.with_effects([vfx.Resize(width=target_width)])
-                            clip = clip.cropped(x1=clip.w/2 - target_width/2, width=target_width, height=target_height)
-                        
-                        # Loop if too short
-                        if clip.duration < sentence_duration:
-                            clip = clip.loop(duration=sentence_duration)
-                        else:
-                            clip = clip.subclipped(0, sentence_duration)
-                            
-                        scene_clip = clip
-                        break
-                    except Exception as e:
-                        print(f"Error processing clip: {e}")
-            
-            # Fallback if no video found
+            if resolved:
+                scene_clip, asset = resolved
+                if asset["kind"] == "library":
+                    used_clips.add(asset["clip_id"])
+                elif asset["kind"] == "stock":
+                    used_clips.add(asset["candidate"]["id"])
+                if quality == "draft":
+                    remember_scene(scene_key, asset=asset)
+
+            # Modern Fallback (Color) if neither source produced a clip in time
             if not scene_clip:
-                # 1. Try AI Image Generation if Gemini Key is present
-                if api_key_gemini:
-                    try:
-                        # Get prompt from Gemini
-                        config_args = {"api_key": api_key_gemini}
-                        if api_endpoint_gemini:
-                            # Sanitize endpoint
-                            if "googleapis.com" in api_endpoint_gemini and "/models/" in api_endpoint_gemini:
-                                 from urllib.parse import urlparse
-                                 parsed = urlparse(api_endpoint_gemini)
-                                 api_endpoint_gemini = f"{parsed.scheme}://{parsed.netloc}"
-                            config_args["client_options"] = {"api_endpoint": api_endpoint_gemini}
-                        genai.configure(**config_args)
-                        
-                        # Try models in order
-                        models_to_try = ['gemini-2.0-flash', 'gemini-1.5-flash', 'gemini-pro']
-                        prompt_resp = None
-                        
-                        prompt_req = f"Create a vivid, cinematic image prompt for this scene: '{sentence}'. Genre: {base_genre}. Keep it under 20 words."
-                        
-                        for model_name in models_to_try:
-                            try:
-                                m = genai.GenerativeModel(model_name)
-                                prompt_resp = m.generate_content(prompt_req)
-                                if prompt_resp:
-                                    break
-                            except:
-                                continue
-                        
-                        if prompt_resp:
-                            img_prompt = prompt_resp.text.strip()
-                            print(f"Generated Image Prompt: {img_prompt}")
-                            
-                            img_path = generate_fallback_image(img_prompt)
-                            if img_path:
-                                img_clip = ImageClip(img_path).with_duration(sentence_duration)
-                                # Resize image to target
-                                img_clip = img_clip.with_effects([vfx.Resize(height=target_height)])
-                                if img_clip.w < target_width:
-                                    img_clip = img_clip.with_effects([vfx.Resize(width=target_width)])
-                                img_clip = img_clip.cropped(x1=img_clip.w/2 - target_width/2, width=target_width, height=target_height)
-                                scene_clip = img_clip
-                    except Exception as e:
-                        print(f"AI Image Fallback Failed: {e}")
-
-                # 2. Modern Fallback (Color) if still no clip
-                if not scene_clip:
-                    bg_color = (20, 20, 30) # Dark Blue-Grey
-                    scene_clip = ColorClip(size=(target_width, target_height), color=bg_color, duration=sentence_duration)
+                degraded = True
+                bg_color = (20, 20, 30) # Dark Blue-Grey
+                scene_clip = ColorClip(size=(target_width, target_height), color=bg_color, duration=sentence_duration)
 
             # Add Subtitles (Modern Style)
             try:
@@ -364,7 +810,9 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
                 wrapped_text = "\n".join([sentence[i:i+40] for i in range(0, len(sentence), 40)])
                 
                 # Smart Styling
-                style = get_smart_styling(sentence, base_genre, api_key_gemini, api_endpoint_gemini)
+                style = remembered.get("style") or await get_smart_styling(sentence, base_genre, api_key_gemini, api_endpoint_gemini)
+                if quality == "draft":
+                    remember_scene(scene_key, style=style)
                 print(f"Smart Style: {style}")
                 
                 # Map position to TextClip arguments or CompositeVideoClip positioning
@@ -372,12 +820,12 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
                 
                 txt_clip = TextClip(
                     text=wrapped_text, 
-                    font_size=80 if aspect_ratio == "16:9" else 60, 
+                    font_size=round((80 if aspect_ratio == "16:9" else 60) * text_scale), 
                     color=style.get("color", "#FFD700"), 
                     stroke_color='black', 
-                    stroke_width=3, 
+                    stroke_width=max(1, round(3 * text_scale)), 
                     font=r'C:\Windows\Fonts\arial.ttf', # Keep safe font for now, or map style['font'] if we verify paths
-                    size=(target_width - 200, None), # Width constraint, auto height
+                    size=(target_width - round(200 * text_scale), None), # Width constraint, auto height
                     method='caption',
                     text_align='center'
                 )
@@ -440,39 +888,44 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
             output_path = tmp_out.name
         
         # Write video file
-        # Check for GPU and try to use hardware encoders
-        device_name = get_hardware_device()
-        print(f"DEBUG: Detected device for encoding: {device_name}")
-        
-        # Helper to check encoder availability
-        def check_encoder(enc_name):
-            try:
-                res = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True)
-                return enc_name in res.stdout
-            except:
-                return False
-
         # Define codec priority based on device
         ffmpeg_params = ["-pix_fmt", "yuv420p"] # Standard pixel format
         codec = 'libx264' # Default CPU
         preset = 'ultrafast' # Default to fast for CPU
-        
-        if "NVIDIA" in device_name and check_encoder("h264_nvenc"):
-            print("Attempting to render with GPU (NVIDIA) using h264_nvenc...")
-            codec = 'h264_nvenc'
-            # Use p1 (fastest) to ensure it works and is fast
-            ffmpeg_params.extend(["-preset", "p1", "-rc", "constqp", "-qp", "28"])
-            preset = None # Params handle it
-        elif "AMD" in device_name and check_encoder("h264_amf"):
-            print("Attempting to render with GPU (AMD) using h264_amf...")
-            codec = 'h264_amf'
-            ffmpeg_params.extend(["-usage", "transcoding", "-rc", "cqp", "-qp_i", "28"])
-            preset = None
-        elif "Intel" in device_name and check_encoder("h264_qsv"):
-            print("Attempting to render with GPU (Intel) using h264_qsv...")
-            codec = 'h264_qsv'
-            ffmpeg_params.extend(["-global_quality", "28", "-preset", "veryfast"])
-            preset = None
+
+        if quality == "draft":
+            # Cheapest possible encode; quality doesn't matter for a preview
+            print("Draft render: skipping hardware encoder detection")
+            ffmpeg_params.extend(["-crf", "32", "-tune", "fastdecode"])
+        else:
+            # Check for GPU and try to use hardware encoders
+            device_name = get_hardware_device()
+            print(f"DEBUG: Detected device for encoding: {device_name}")
+            
+            # Helper to check encoder availability
+            def check_encoder(enc_name):
+                try:
+                    res = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True)
+                    return enc_name in res.stdout
+                except:
+                    return False
+
+            if "NVIDIA" in device_name and check_encoder("h264_nvenc"):
+                print("Attempting to render with GPU (NVIDIA) using h264_nvenc...")
+                codec = 'h264_nvenc'
+                # Use p1 (fastest) to ensure it works and is fast
+                ffmpeg_params.extend(["-preset", "p1", "-rc", "constqp", "-qp", "28"])
+                preset = None # Params handle it
+            elif "AMD" in device_name and check_encoder("h264_amf"):
+                print("Attempting to render with GPU (AMD) using h264_amf...")
+                codec = 'h264_amf'
+                ffmpeg_params.extend(["-usage", "transcoding", "-rc", "cqp", "-qp_i", "28"])
+                preset = None
+            elif "Intel" in device_name and check_encoder("h264_qsv"):
+                print("Attempting to render with GPU (Intel) using h264_qsv...")
+                codec = 'h264_qsv'
+                ffmpeg_params.extend(["-global_quality", "28", "-preset", "veryfast"])
+                preset = None
             
         # Write Video
         try:
@@ -482,7 +935,7 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
             # Prepare kwargs
             write_kwargs = {
                 "filename": output_path,
-                "fps": 24,
+                "fps": fps,
                 "codec": codec,
                 "audio_codec": "aac",
                 "ffmpeg_params": ffmpeg_params,
@@ -490,6 +943,8 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
             }
             if preset:
                 write_kwargs["preset"] = preset
+            if quality == "draft":
+                write_kwargs["audio_bitrate"] = "64k"
             
             await asyncio.to_thread(final_clip.write_videofile, **write_kwargs)
             
@@ -499,45 +954,19 @@ async def generate_video(script_text, voiceover_file, competitor_url, base_genre
             await asyncio.to_thread(
                 final_clip.write_videofile,
                 output_path, 
-                fps=24, 
-                codec='libx264',
-                audio_codec="aac",
-                preset='ultrafast',
-                threads=12
-            )
-            
-        # Write Video
-        try:
-            # Run blocking write_videofile in a separate thread to keep event loop alive for status updates
-            print(f"Starting background rendering with {codec}...")
-            await asyncio.to_thread(
-                final_clip.write_videofile,
-                output_path, 
-                fps=24, 
-                codec=codec, 
-                audio_codec="aac",
-                ffmpeg_params=ffmpeg_params,
-                threads=12
-            )
-        except Exception as e:
-            print(f"Hardware encoding failed ({e}). Falling back to CPU (Ultrafast)...")
-            # Fallback to CPU with ultrafast preset to avoid 20 min waits
-            await asyncio.to_thread(
-                final_clip.write_videofile,
-                output_path, 
-                fps=24, 
+                fps=fps, 
                 codec='libx264',
                 audio_codec="aac",
                 preset='ultrafast',
                 threads=12
             )
         
-        return output_path
+        return output_path, degraded
         
 
 
     except Exception as e:
-        print(f"Error in generate_video: {e}")
+        print(f"Error in render_video: {e}")
         raise e
     finally:
         # Cleanup audio file
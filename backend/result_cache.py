@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+CACHE_DIR = os.getenv("STREAMLINE_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "streamline_results"))
+MAX_CACHE_BYTES = 2 * 1024 ** 3   # Oldest results are evicted past this total size
+
+
+def make_job_key(**fields):
+    """
+    Hashes everything that determines a job's output into a stable cache key.
+    Bytes fields (voiceover, music) are hashed by content; None and b"" are distinct.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(fields):
+        value = fields[name]
+        if isinstance(value, (bytes, bytearray)):
+            value = "bytes:" + hashlib.sha256(value).hexdigest()
+        digest.update(f"{name}={value!r}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    # A hard link is instant and independent of the other name being moved or deleted
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """
+    Finished MP4s stored on disk by job key, evicting the least recently used past max_bytes.
+    Callers always get their own file, so moving or deleting it never affects the cache.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp4")
+
+    def get(self, key):
+        """Returns a fresh path holding the cached video for key, or None on a miss."""
+        path = self._path(key)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            try:
+                os.utime(path) # Mark as recently used
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
+                    out_path = tmp.name
+                os.remove(out_path)
+                link_or_copy(path, out_path)
+                return out_path
+            except OSError as e:
+                print(f"Result cache read failed: {e}")
+                return None
+
+    def put(self, key, output_path):
+        """Stores a finished video under key, then evicts old entries if over budget."""
+        path = self._path(key)
+        with self._lock:
+            try:
+                tmp_path = f"{path}.{threading.get_ident()}.part"
+                link_or_copy(output_path, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Result cache write failed: {e}")
+                return
+            self._evict(keep=path)
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".mp4"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Still being served on Windows; try again next time
+                pass